@@ -5,12 +5,21 @@ Uses local filesystem for hackathon speed - swap to S3/Supabase later if needed.
 
 import os
 import base64
-import uuid
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image
 from io import BytesIO
 from typing import Optional
 
+# pybase64 encodes/decodes in 16-byte SIMD lanes - 5-10x faster than the
+# stdlib on megabyte image payloads; same API, so fall back transparently
+try:
+    import pybase64 as _b64
+except ImportError:
+    _b64 = base64
+
 # Directories
 BASE_DIR = Path(__file__).parent
 UPLOADS_DIR = BASE_DIR / "uploads"
@@ -22,48 +31,105 @@ RESULTS_DIR.mkdir(exist_ok=True)
 
 
 def generate_id() -> str:
-    """Generate a unique ID for a cloaking session."""
-    return str(uuid.uuid4())[:8]
+    """
+    Generate a unique ID for a cloaking session.
+
+    Nanosecond timestamp + pid, url/filename-safe encoded - unique across
+    workers without uuid4's per-call urandom read.
+    """
+    raw = struct.pack(">QH", time.time_ns(), os.getpid() & 0xFFFF)
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
 
+# JPEG for photographic results - encodes several times faster than PNG
+# and the files are ~5-10x smaller; pass fmt="PNG" where lossless matters
+JPEG_QUALITY = 90
 
-def save_image(image: Image.Image, directory: Path, name: str) -> str:
-    """Save a PIL Image to disk and return the path."""
-    filepath = directory / f"{name}.png"
-    image.save(filepath, "PNG")
+
+def encode_image(image: Image.Image, fmt: str = "JPEG") -> bytes:
+    """Encode a PIL Image to bytes once - reusable for disk and base64."""
+    buffer = BytesIO()
+    if fmt == "JPEG":
+        image.save(buffer, format="JPEG", quality=JPEG_QUALITY)
+    else:
+        image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def save_image(image: Image.Image, directory: Path, name: str,
+               fmt: str = "JPEG", data: Optional[bytes] = None) -> str:
+    """
+    Save a PIL Image to disk and return the path.
+
+    Pass data to write already-encoded bytes and skip a second encode.
+    """
+    ext = "jpg" if fmt == "JPEG" else fmt.lower()
+    filepath = directory / f"{name}.{ext}"
+    filepath.write_bytes(data if data is not None else encode_image(image, fmt))
     return str(filepath)
 
 
+def find_image(directory: Path, name: str) -> Optional[Path]:
+    """
+    Find a saved image by stem, whatever format it was written in.
+
+    PNG wins when both exist: the lossless cloaked file must shadow any
+    lossy JPEG left over from an older save of the same stem.
+    """
+    for ext in ("png", "jpg"):
+        candidate = directory / f"{name}.{ext}"
+        if candidate.exists():
+            return candidate
+    return None
+
+
 def load_image(filepath: str) -> Image.Image:
     """Load an image from disk."""
     return Image.open(filepath).convert("RGB")
 
 
-def image_to_base64(image: Image.Image) -> str:
-    """Convert PIL Image to base64 string."""
-    buffer = BytesIO()
-    image.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+def bytes_to_base64(data: bytes) -> str:
+    """Base64-encode already-encoded image bytes."""
+    return _b64.b64encode(data).decode("utf-8")
+
+
+def image_to_base64(image: Image.Image, fmt: str = "JPEG") -> str:
+    """Convert PIL Image to base64 string (JPEG by default - far smaller payloads)."""
+    return bytes_to_base64(encode_image(image, fmt))
 
 
 def base64_to_image(b64_string: str) -> Image.Image:
     """Convert base64 string to PIL Image."""
-    image_data = base64.b64decode(b64_string)
+    image_data = _b64.b64decode(b64_string)
     return Image.open(BytesIO(image_data)).convert("RGB")
 
 
 def save_upload(image: Image.Image, session_id: str) -> str:
     """Save an uploaded original image."""
+    _invalidate_paths(session_id)
     return save_image(image, UPLOADS_DIR, f"{session_id}_original")
 
 
-def save_cloaked(image: Image.Image, session_id: str) -> str:
-    """Save a cloaked image (subtle, user-facing)."""
-    return save_image(image, RESULTS_DIR, f"{session_id}_cloaked")
+def save_cloaked(image: Image.Image, session_id: str, data: Optional[bytes] = None) -> str:
+    """
+    Save a cloaked image (subtle, user-facing).
+
+    Stays PNG: the adversarial perturbation is fragile and JPEG
+    quantization would blunt it when the user re-uploads this file.
+    """
+    _invalidate_paths(session_id)
+    return save_image(image, RESULTS_DIR, f"{session_id}_cloaked", fmt="PNG", data=data)
 
 
-def save_proof_version(image: Image.Image, session_id: str) -> str:
+def save_proof_version(image: Image.Image, session_id: str, data: Optional[bytes] = None) -> str:
     """Save the proof version (heavy cloak, for proof modal)."""
-    return save_image(image, RESULTS_DIR, f"{session_id}_proof")
+    _invalidate_paths(session_id)
+    return save_image(image, RESULTS_DIR, f"{session_id}_proof", data=data)
+
+
+# PIL releases the GIL while encoding, so the four proof artifacts
+# encode side by side instead of back to back
+_SAVE_POOL = ThreadPoolExecutor(max_workers=4)
 
 
 def save_proof_images(
@@ -73,30 +139,54 @@ def save_proof_images(
     deepfake_original: Image.Image,
     deepfake_cloaked: Image.Image
 ) -> dict:
-    """Save all proof images and return paths."""
-    return {
-        "original": save_image(original, RESULTS_DIR, f"{session_id}_original"),
-        "cloaked": save_image(cloaked, RESULTS_DIR, f"{session_id}_cloaked"),
-        "deepfake_original": save_image(deepfake_original, RESULTS_DIR, f"{session_id}_deepfake_original"),
-        "deepfake_cloaked": save_image(deepfake_cloaked, RESULTS_DIR, f"{session_id}_deepfake_cloaked"),
+    """Save all proof images and return paths (encoded in parallel)."""
+    _invalidate_paths(session_id)
+    jobs = {
+        "original": _SAVE_POOL.submit(save_image, original, RESULTS_DIR, f"{session_id}_original"),
+        "cloaked": _SAVE_POOL.submit(save_image, cloaked, RESULTS_DIR, f"{session_id}_cloaked", "PNG"),
+        "deepfake_original": _SAVE_POOL.submit(save_image, deepfake_original, RESULTS_DIR, f"{session_id}_deepfake_original"),
+        "deepfake_cloaked": _SAVE_POOL.submit(save_image, deepfake_cloaked, RESULTS_DIR, f"{session_id}_deepfake_cloaked"),
     }
+    return {name: job.result() for name, job in jobs.items()}
+
+
+# Dashboard clients poll get_result_paths, but a session's files only
+# change when a save lands - a short TTL plus explicit invalidation on
+# save removes almost every per-poll stat() call
+_PATHS_TTL = 30.0
+_PATHS_CACHE_MAX = 10_000
+_paths_cache: dict = {}
+
+
+def _invalidate_paths(session_id: str) -> None:
+    _paths_cache.pop(session_id, None)
 
 
 def get_result_paths(session_id: str) -> Optional[dict]:
-    """Get paths to all result images for a session."""
-    # Original is in uploads, everything else in results
-    original_path = UPLOADS_DIR / f"{session_id}_original.png"
-    cloaked_path = RESULTS_DIR / f"{session_id}_cloaked.png"
+    """Get paths to all result images for a session (cached briefly)."""
+    now = time.monotonic()
+    entry = _paths_cache.get(session_id)
+    if entry is not None and now - entry[0] < _PATHS_TTL:
+        return entry[1]
+
+    # Original is in uploads, everything else in results. Extensions vary
+    # (older sessions are PNG, current ones JPEG), so resolve by stem.
+    original_path = find_image(UPLOADS_DIR, f"{session_id}_original")
+    cloaked_path = find_image(RESULTS_DIR, f"{session_id}_cloaked")
 
     # Check if at least original and cloaked exist
-    if not original_path.exists() or not cloaked_path.exists():
+    if original_path is None or cloaked_path is None:
         return None
 
     paths = {
         "original": original_path,
         "cloaked": cloaked_path,
-        "deepfake_original": RESULTS_DIR / f"{session_id}_deepfake_original.png",
-        "deepfake_cloaked": RESULTS_DIR / f"{session_id}_deepfake_cloaked.png",
+        "deepfake_original": find_image(RESULTS_DIR, f"{session_id}_deepfake_original"),
+        "deepfake_cloaked": find_image(RESULTS_DIR, f"{session_id}_deepfake_cloaked"),
     }
 
-    return {k: str(v) for k, v in paths.items() if v.exists()}
+    result = {k: str(v) for k, v in paths.items() if v is not None}
+    if len(_paths_cache) >= _PATHS_CACHE_MAX:
+        _paths_cache.pop(next(iter(_paths_cache)))
+    _paths_cache[session_id] = (now, result)
+    return result